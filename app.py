@@ -5,17 +5,26 @@ A Flask web app that provides a simple interface for the EU eTranslation API
 Based on the official EU documentation examples
 """
 
-from flask import Flask, render_template, request, jsonify, url_for, redirect
+from flask import Flask, render_template, request, jsonify, url_for, redirect, Response
 import requests
 from requests.auth import HTTPDigestAuth
 import json
 import threading
 import time
+import hmac
+import math
+from functools import wraps
 from datetime import datetime
 import os
+from urllib.parse import urlencode
 from config import config
+import callbacks
+import export
+import instrumentation
+from instrumentation import phase, route_stats, profiler
 
 app = Flask(__name__)
+instrumentation.init_app(app)
 
 # Load configuration from environment variables
 try:
@@ -30,21 +39,86 @@ except Exception as e:
 # Global correlation map to store translation results
 correlation_map = {}
 
-def get_callback_url():
-    """Get the appropriate callback URL for production or development"""
+# Request IDs in the order they completed; positions in this list are export cursors
+completed_log = []
+
+# Signed callbacks that arrived before their request ID was stored
+pending_callbacks = callbacks.PendingCallbacks(config.callback_buffer_size, config.callback_hold_seconds)
+
+# Serializes "store request, claim early callback" against "look up request, hold callback"
+callback_lock = threading.Lock()
+
+def get_callback_url(nonce=None):
+    """
+    Get the appropriate callback URL for production or development
+    When a nonce is given, the URL carries it together with its HMAC token
+    """
+    query = ''
+    if nonce:
+        query = '?' + urlencode({'nonce': nonce, 'token': callbacks.sign(nonce, config.callback_secret)})
     
     # Check for production environment variables first
     production_url = os.getenv('PRODUCTION_URL')
     if production_url:
         callback_url = f"{production_url.rstrip('/')}/callback"
         print(f"🌍 Using production callback URL: {callback_url}")
-        return callback_url
+        return callback_url + query
     
     # Fallback to local URL (for local development)
     callback_url = url_for('callback', _external=True)
     print(f"⚠️  Using local callback URL: {callback_url}")
     print("   Note: EU eTranslation may not be able to reach this URL!")
-    return callback_url
+    return callback_url + query
+
+def complete_translation(request_id, translated_text):
+    """Mark a stored request as completed with its translated text"""
+    first_completion = correlation_map[request_id]['status'] != 'completed'
+    correlation_map[request_id]['status'] = 'completed'
+    correlation_map[request_id]['translation'] = translated_text
+    correlation_map[request_id]['completed_at'] = datetime.now().isoformat()
+    if first_completion:
+        # Duplicate callbacks must not show up twice in exports
+        completed_log.append(request_id)
+    
+    # Calculate how long it took
+    try:
+        start_time = datetime.fromisoformat(correlation_map[request_id]['timestamp'])
+        duration = datetime.now() - start_time
+        print(f"⏱️  Translation completed in {duration.total_seconds():.1f} seconds")
+        correlation_map[request_id]['duration_seconds'] = duration.total_seconds()
+    except:
+        pass
+
+def send_translation_request(translation_request, timeout=30):
+    """POST a translation request to eTranslation, timing serialization and the upstream call"""
+    with phase('serialization'):
+        json_request = json.dumps(translation_request)
+    
+    headers = {'Content-Type': 'application/json'}
+    
+    with phase('upstream'):
+        response = requests.post(
+            config.rest_url,
+            auth=HTTPDigestAuth(config.application_name, config.api_password),
+            headers=headers,
+            data=json_request,
+            timeout=timeout
+        )
+    instrumentation.record_upstream_phases(response)
+    return response
+
+def admin_required(view):
+    """Protect an endpoint with the ADMIN_TOKEN (sent as X-Admin-Token header)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = config.admin_token
+        if not expected:
+            return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 404
+        provided = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(provided.encode(), expected.encode()):
+            return jsonify({'error': 'Invalid admin token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
 # Supported languages (based on common EU languages)
 SUPPORTED_LANGUAGES = {
@@ -77,7 +151,8 @@ SUPPORTED_LANGUAGES = {
 @app.route('/')
 def index():
     """Main page with translation interface"""
-    return render_template('index.html', languages=SUPPORTED_LANGUAGES)
+    with phase('render'):
+        return render_template('index.html', languages=SUPPORTED_LANGUAGES)
 
 @app.route('/receiveRequest', methods=['POST'])
 def receive_request():
@@ -104,8 +179,9 @@ def receive_request():
         print(f"Translation request: {source_language} -> {target_language}")
         print(f"Text: {text_to_translate[:100]}{'...' if len(text_to_translate) > 100 else ''}")
         
-        # Get the callback URL dynamically
-        callback_url = get_callback_url()
+        # Get the callback URL dynamically, signed for this request
+        callback_nonce = callbacks.new_nonce()
+        callback_url = get_callback_url(callback_nonce)
         
         # Build translation request (based on official example)
         translation_request = {
@@ -119,20 +195,8 @@ def receive_request():
             'requesterCallback': callback_url
         }
         
-        # Convert to JSON
-        json_request = json.dumps(translation_request)
-        
-        # Set headers
-        headers = {'Content-Type': 'application/json'}
-        
         # Send request to eTranslation API
-        response = requests.post(
-            config.rest_url,
-            auth=HTTPDigestAuth(config.application_name, config.api_password),
-            headers=headers,
-            data=json_request,
-            timeout=30
-        )
+        response = send_translation_request(translation_request)
         
         request_id = response.text.strip()
         print(f"eTranslation API response: {response.status_code}, ID: {request_id}")
@@ -143,14 +207,22 @@ def receive_request():
                 id_num = int(request_id)
                 if id_num > 0:
                     # Store the request ID with empty translation (will be filled by callback)
-                    correlation_map[request_id] = {
-                        'status': 'pending',
-                        'translation': None,
-                        'timestamp': datetime.now().isoformat(),
-                        'source_language': source_language,
-                        'target_language': target_language,
-                        'original_text': text_to_translate
-                    }
+                    with phase('store'), callback_lock:
+                        correlation_map[request_id] = {
+                            'status': 'pending',
+                            'translation': None,
+                            'timestamp': datetime.now().isoformat(),
+                            'source_language': source_language,
+                            'target_language': target_language,
+                            'original_text': text_to_translate,
+                            'callback_nonce': callback_nonce
+                        }
+                        
+                        # The callback may have beaten the API response
+                        early_callback = pending_callbacks.pop(request_id, callback_nonce)
+                        if early_callback is not None:
+                            print(f"📥 Applying early callback held for ID: {request_id}")
+                            complete_translation(request_id, early_callback['translated_text'])
                     print(f"Request stored with ID: {request_id} at {datetime.now()}")
                     print(f"Translation: {source_language} -> {target_language}, {len(text_to_translate)} characters")
                     return request_id
@@ -184,8 +256,9 @@ def check_result():
             return "", 400
         
         # Check if translation is available
-        if request_id in correlation_map:
-            translation_data = correlation_map[request_id]
+        with phase('store'):
+            translation_data = correlation_map.get(request_id)
+        if translation_data is not None:
             if translation_data['status'] == 'completed' and translation_data['translation']:
                 print(f"Translation ready for ID: {request_id}")
                 return translation_data['translation']
@@ -248,6 +321,13 @@ def callback():
                 "timestamp": datetime.now().isoformat()
             }), 200
         
+        # Verify the signed callback URL before touching the request body
+        nonce = request.args.get('nonce', '')
+        token = request.args.get('token', '')
+        if not callbacks.verify(nonce, token, config.callback_secret):
+            print(f"🚫 Rejected unsigned callback from {request.environ.get('REMOTE_ADDR', 'unknown')}")
+            return "FORBIDDEN", 403
+        
         # Handle POST requests (from EU eTranslation)
         print("=" * 60)
         print("🎉 CALLBACK RECEIVED FROM ETRANSLATION!")
@@ -273,33 +353,24 @@ def callback():
         print(f"📝 Translation: {translated_text[:100]}{'...' if len(translated_text) > 100 else ''}")
         
         # Store the translation result
-        if request_id in correlation_map:
-            correlation_map[request_id]['status'] = 'completed'
-            correlation_map[request_id]['translation'] = translated_text
-            correlation_map[request_id]['completed_at'] = datetime.now().isoformat()
-            
-            # Calculate how long it took
-            try:
-                start_time = datetime.fromisoformat(correlation_map[request_id]['timestamp'])
-                duration = datetime.now() - start_time
-                print(f"⏱️  Translation completed in {duration.total_seconds():.1f} seconds")
-                correlation_map[request_id]['duration_seconds'] = duration.total_seconds()
-            except:
-                pass
+        with phase('store'), callback_lock:
+            translation_data = correlation_map.get(request_id)
+            if translation_data is not None:
+                if not hmac.compare_digest(translation_data.get('callback_nonce', '').encode(), nonce.encode()):
+                    print(f"🚫 Callback token does not belong to request ID: {request_id}")
+                    print("=" * 60)
+                    return "FORBIDDEN", 403
                 
-            print(f"✅ Translation stored for ID: {request_id}")
-        else:
-            print(f"⚠️  Warning: Received callback for unknown request ID: {request_id}")
-            print("   This might be from an earlier session or timing issue")
-            # Store it anyway in case of timing issues
-            correlation_map[request_id] = {
-                'status': 'completed',
-                'translation': translated_text,
-                'timestamp': datetime.now().isoformat(),
-                'target_language': target_language,
-                'completed_at': datetime.now().isoformat()
-            }
-            print(f"📥 Stored unknown callback for ID: {request_id}")
+                complete_translation(request_id, translated_text)
+                print(f"✅ Translation stored for ID: {request_id}")
+            elif pending_callbacks.hold(request_id, nonce, {
+                'translated_text': translated_text,
+                'target_language': target_language
+            }):
+                # Signed but not stored yet - the API response may still be on its way
+                print(f"⏳ Holding callback for unknown request ID: {request_id} ({len(pending_callbacks)} held)")
+            else:
+                print(f"⚠️  Dropped callback for unknown request ID: {request_id}")
         
         print("✅ Callback processed successfully!")
         print("=" * 60)
@@ -315,19 +386,24 @@ def status():
     """Debug endpoint to check correlation map status and connection info"""
     callback_url = get_callback_url()
     
-    return jsonify({
-        'callback_url': callback_url,
-        'deployment_mode': 'production' if os.getenv('PRODUCTION_URL') else 'local',
-        'callback_reachable': bool(os.getenv('PRODUCTION_URL')),
-        'active_translations': len(correlation_map),
-        'translations': {k: {
+    with phase('store'):
+        translations = {k: {
             'status': v['status'],
             'has_translation': bool(v.get('translation')),
             'timestamp': v.get('timestamp'),
             'source_language': v.get('source_language'),
             'target_language': v.get('target_language')
-        } for k, v in correlation_map.items()}
-    })
+        } for k, v in list(correlation_map.items())}
+    
+    with phase('serialization'):
+        return jsonify({
+            'callback_url': callback_url,
+            'deployment_mode': 'production' if os.getenv('PRODUCTION_URL') else 'local',
+            'callback_reachable': bool(os.getenv('PRODUCTION_URL')),
+            'active_translations': len(correlation_map),
+            'held_callbacks': len(pending_callbacks),
+            'translations': translations
+        })
 
 @app.route('/test')
 def test():
@@ -347,19 +423,11 @@ def api_test():
                 "username": config.email
             },
             'textToTranslate': 'Hello World!',
-            'requesterCallback': url_for('callback', _external=True)
+            # Unsigned on purpose: callbacks for test requests are rejected, not held
+            'requesterCallback': get_callback_url()
         }
         
-        headers = {'Content-Type': 'application/json'}
-        json_request = json.dumps(test_request)
-        
-        response = requests.post(
-            config.rest_url,
-            auth=HTTPDigestAuth(config.application_name, config.api_password),
-            headers=headers,
-            data=json_request,
-            timeout=30
-        )
+        response = send_translation_request(test_request)
         
         return jsonify({
             'status_code': response.status_code,
@@ -378,8 +446,9 @@ def api_test():
 @app.route('/debug/<request_id>')
 def debug_translation(request_id):
     """Debug endpoint to check a specific translation by ID"""
-    if request_id in correlation_map:
-        translation_data = correlation_map[request_id]
+    with phase('store'):
+        translation_data = correlation_map.get(request_id)
+    if translation_data is not None:
         return jsonify({
             'request_id': request_id,
             'status': translation_data['status'],
@@ -417,19 +486,11 @@ def diagnose_service():
                 "username": config.email
             },
             'textToTranslate': 'Test',
-            'requesterCallback': url_for('callback', _external=True)
+            # Unsigned on purpose: callbacks for test requests are rejected, not held
+            'requesterCallback': get_callback_url()
         }
         
-        headers = {'Content-Type': 'application/json'}
-        json_request = json.dumps(test_request)
-        
-        response = requests.post(
-            config.rest_url,
-            auth=HTTPDigestAuth(config.application_name, config.api_password),
-            headers=headers,
-            data=json_request,
-            timeout=10
-        )
+        response = send_translation_request(test_request, timeout=10)
         
         test_result = {
             'test': 'Quick connectivity test',
@@ -479,16 +540,17 @@ def diagnose_service():
     # Test 2: Check if callbacks are being received
     recent_callbacks = 0
     completed_translations = 0
-    for req_id, data in correlation_map.items():
-        if data['status'] == 'completed':
-            completed_translations += 1
-            if 'completed_at' in data:
-                try:
-                    completed_time = datetime.fromisoformat(data['completed_at'])
-                    if (datetime.now() - completed_time).total_seconds() < 3600:  # Last hour
-                        recent_callbacks += 1
-                except:
-                    pass
+    with phase('store'):
+        for req_id, data in correlation_map.items():
+            if data['status'] == 'completed':
+                completed_translations += 1
+                if 'completed_at' in data:
+                    try:
+                        completed_time = datetime.fromisoformat(data['completed_at'])
+                        if (datetime.now() - completed_time).total_seconds() < 3600:  # Last hour
+                            recent_callbacks += 1
+                    except:
+                        pass
     
     results['callback_analysis'] = {
         'total_completed_translations': completed_translations,
@@ -501,18 +563,19 @@ def diagnose_service():
     
     # Test 3: Analyze pending translations
     pending_translations = []
-    for req_id, data in correlation_map.items():
-        if data['status'] == 'pending':
-            try:
-                wait_time = (datetime.now() - datetime.fromisoformat(data['timestamp'])).total_seconds()
-                pending_translations.append({
-                    'request_id': req_id,
-                    'wait_time_seconds': int(wait_time),
-                    'wait_time_minutes': round(wait_time / 60, 1),
-                    'language_pair': f"{data.get('source_language', '?')} -> {data.get('target_language', '?')}"
-                })
-            except:
-                pass
+    with phase('store'):
+        for req_id, data in correlation_map.items():
+            if data['status'] == 'pending':
+                try:
+                    wait_time = (datetime.now() - datetime.fromisoformat(data['timestamp'])).total_seconds()
+                    pending_translations.append({
+                        'request_id': req_id,
+                        'wait_time_seconds': int(wait_time),
+                        'wait_time_minutes': round(wait_time / 60, 1),
+                        'language_pair': f"{data.get('source_language', '?')} -> {data.get('target_language', '?')}"
+                    })
+                except:
+                    pass
     
     results['pending_analysis'] = {
         'count': len(pending_translations),
@@ -544,20 +607,12 @@ def test_quick_translation():
                 "username": config.email
             },
             'textToTranslate': 'Hello',
-            'requesterCallback': url_for('callback', _external=True)
+            # Unsigned on purpose: callbacks for test requests are rejected, not held
+            'requesterCallback': get_callback_url()
         }
         
-        headers = {'Content-Type': 'application/json'}
-        json_request = json.dumps(test_request)
-        
         start_time = datetime.now()
-        response = requests.post(
-            config.rest_url,
-            auth=HTTPDigestAuth(config.application_name, config.api_password),
-            headers=headers,
-            data=json_request,
-            timeout=30
-        )
+        response = send_translation_request(test_request)
         end_time = datetime.now()
         
         return jsonify({
@@ -580,6 +635,7 @@ def test_callback():
     """Test endpoint to verify callback functionality"""
     if request.method == 'GET':
         # Display a simple form to test callback manually
+        # The form is unsigned, so the real callback handler answers it with 403
         return '''
         <!DOCTYPE html>
         <html>
@@ -623,6 +679,94 @@ def callback_log():
         }
     })
 
+@app.route('/admin/timings', methods=['GET', 'DELETE'])
+@admin_required
+def admin_timings():
+    """Aggregated per-route and per-phase timings (DELETE resets them)"""
+    if request.method == 'DELETE':
+        route_stats.reset()
+        return jsonify({'status': 'reset', 'timestamp': datetime.now().isoformat()})
+    
+    return jsonify({
+        'pid': os.getpid(),
+        'timestamp': datetime.now().isoformat(),
+        'routes': route_stats.snapshot()
+    })
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+@admin_required
+def admin_profile():
+    """Start a sampling profiler run for N seconds (POST) or show its state (GET)"""
+    if request.method == 'POST':
+        try:
+            seconds = float(request.values.get('seconds', '30'))
+        except ValueError:
+            return jsonify({'error': 'seconds must be a number'}), 400
+        if not math.isfinite(seconds) or seconds <= 0 or seconds > config.profile_max_seconds:
+            return jsonify({'error': f'seconds must be between 0 and {config.profile_max_seconds}'}), 400
+        
+        output_path = profiler.start(seconds, config.profile_interval_ms, config.profile_dir)
+        if output_path is None:
+            return jsonify({'error': 'A profiling run is already in progress', 'started_at': profiler.started_at}), 409
+        
+        print(f"🔥 Profiling started for {seconds:.0f}s, writing to {output_path}")
+        return jsonify({
+            'status': 'started',
+            'seconds': seconds,
+            'output': output_path,
+            'pid': os.getpid()
+        }), 202
+    
+    return jsonify({
+        'running': profiler.running,
+        'started_at': profiler.started_at,
+        'last_output': profiler.last_output,
+        'pid': os.getpid()
+    })
+
+@app.route('/admin/export')
+@admin_required
+def admin_export():
+    """
+    Stream one page of completed translations as gzip-compressed JSONL
+    Filters: since/until (ISO timestamps on completed_at), source/target language, limit;
+    resume with cursor set to the X-Export-Next-Cursor header of the previous page
+    """
+    try:
+        position = export.parse_cursor(request.args.get('cursor'))
+        limit = int(request.args['limit']) if request.args.get('limit') else config.export_page_size
+        since = export.parse_timestamp(request.args.get('since'))
+        until = export.parse_timestamp(request.args.get('until'))
+    except export.StaleCursorError as e:
+        return jsonify({'error': str(e), 'epoch': export.EPOCH}), 409
+    except ValueError as e:
+        return jsonify({'error': f'Invalid export parameter: {e}'}), 400
+    if limit <= 0:
+        return jsonify({'error': 'limit must be positive'}), 400
+    # Keep every response short so the export never ties up a worker for long
+    limit = min(limit, config.export_max_page_size)
+    
+    # Both the records returned and the log entries scanned are capped, so rare filters
+    # produce short (possibly empty) pages that still move the cursor forward
+    with phase('store'):
+        positions, next_position, end_of_log = export.scan_page(
+            correlation_map, completed_log, position, limit, config.export_max_scan,
+            since=since, until=until,
+            source_language=request.args.get('source', '').strip().upper() or None,
+            target_language=request.args.get('target', '').strip().upper() or None
+        )
+    records = export.iter_records(correlation_map, completed_log, positions)
+    
+    filename = f"translations-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+    return Response(export.gzip_jsonl(records), mimetype='application/gzip', headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Export-Epoch': export.EPOCH,
+        'X-Export-Page-Size': str(limit),
+        'X-Export-Next-Cursor': export.format_cursor(next_position),
+        'X-Export-End': 'true' if end_of_log else 'false',
+        'X-Export-Log-Size': str(len(completed_log))
+    })
+
 if __name__ == '__main__':
     print("Starting EU eTranslation Web Application")
     print("=" * 50)
@@ -0,0 +1,78 @@
+"""
+Callback URL signing for EU eTranslation App
+Per-request HMAC tokens and a small bounded buffer for callbacks that arrive early
+"""
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def new_nonce() -> str:
+    """Random per-request value embedded in the callback URL"""
+    return secrets.token_urlsafe(12)
+
+
+def sign(nonce: str, secret: str) -> str:
+    """HMAC token for a callback nonce"""
+    return hmac.new(secret.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+
+def verify(nonce: str, token: str, secret: str) -> bool:
+    """Check a callback token in constant time"""
+    if not nonce or not token:
+        return False
+    return hmac.compare_digest(sign(nonce, secret).encode(), token.encode())
+
+
+class PendingCallbacks:
+    """
+    Bounded holding area for signed callbacks whose request ID is not known yet
+    This covers callbacks that arrive before the eTranslation POST has returned;
+    entries expire after hold_seconds and the oldest entry is evicted when full.
+    Entries are keyed by nonce, so one signed URL can occupy at most one slot
+    """
+
+    def __init__(self, max_size: int, hold_seconds: float):
+        self.max_size = max_size
+        self.hold_seconds = hold_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def hold(self, request_id: str, nonce: str, data: dict) -> bool:
+        """Keep a callback for later; returns False if the buffer is disabled"""
+        if self.max_size <= 0:
+            return False
+        with self._lock:
+            self._expire()
+            self._entries.pop(nonce, None)
+            self._entries[nonce] = (time.monotonic(), request_id, data)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return True
+
+    def pop(self, request_id: str, nonce: str) -> Optional[dict]:
+        """Claim a held callback if it was signed for the given nonce"""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(nonce)
+            if entry is None or entry[1] != request_id:
+                return None
+            del self._entries[nonce]
+            return entry[2]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._entries)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.hold_seconds
+        while self._entries:
+            received_at = next(iter(self._entries.values()))[0]
+            if received_at >= cutoff:
+                break
+            self._entries.popitem(last=False)
@@ -3,6 +3,7 @@ Configuration management for EU eTranslation App
 Handles environment variables and settings
 """
 import os
+import secrets
 from typing import Optional
 
 try:
@@ -17,7 +18,8 @@ class Config:
     
     def __init__(self):
         # python-dotenv will handle loading if available
-        pass
+        # Fallback callback secret, only valid for the lifetime of this process
+        self._generated_callback_secret = secrets.token_hex(32)
     
     @property
     def application_name(self) -> str:
@@ -62,7 +64,57 @@ class Config:
     def flask_debug(self) -> bool:
         """Flask debug mode"""
         return os.getenv('FLASK_DEBUG', 'false').lower() in ('true', '1', 'yes', 'on')
-    
+
+    @property
+    def callback_secret(self) -> str:
+        """Key for signing callback URLs (random per process if CALLBACK_SECRET is unset)"""
+        return os.getenv('CALLBACK_SECRET') or self._generated_callback_secret
+
+    @property
+    def callback_buffer_size(self) -> int:
+        """Maximum number of signed callbacks held while their request ID is unknown"""
+        return int(os.getenv('CALLBACK_BUFFER_SIZE', '100'))
+
+    @property
+    def callback_hold_seconds(self) -> int:
+        """How long an early callback is held before it is dropped"""
+        return int(os.getenv('CALLBACK_HOLD_SECONDS', '300'))
+
+    @property
+    def export_page_size(self) -> int:
+        """Records per /admin/export response when the client does not ask for a limit"""
+        return int(os.getenv('EXPORT_PAGE_SIZE', '1000'))
+
+    @property
+    def export_max_page_size(self) -> int:
+        """Upper bound for the limit of a single /admin/export response"""
+        return int(os.getenv('EXPORT_MAX_PAGE_SIZE', '10000'))
+
+    @property
+    def export_max_scan(self) -> int:
+        """Upper bound for completion log entries scanned by a single /admin/export response"""
+        return int(os.getenv('EXPORT_MAX_SCAN', '100000'))
+
+    @property
+    def admin_token(self) -> Optional[str]:
+        """Token required by the /admin endpoints (admin endpoints are disabled if unset)"""
+        return os.getenv('ADMIN_TOKEN') or None
+
+    @property
+    def profile_dir(self) -> str:
+        """Directory where sampling profiler stack dumps are written"""
+        return os.getenv('PROFILE_DIR', 'profiles')
+
+    @property
+    def profile_max_seconds(self) -> int:
+        """Upper bound for a single profiling run"""
+        return int(os.getenv('PROFILE_MAX_SECONDS', '120'))
+
+    @property
+    def profile_interval_ms(self) -> float:
+        """Sampling interval of the profiler in milliseconds"""
+        return float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+
     def validate(self) -> bool:
         """Validate that all required configuration is present"""
         try:
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Translation history export for EU eTranslation App
+Streams completed translations as gzip-compressed JSONL with a resumable cursor
+
+Run as a script to download an export from a running app:
+    python export.py --url https://your-app.onrender.com --cursor-file export.cursor
+"""
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+import click
+import requests
+
+from config import config
+
+# gzip container instead of a raw zlib stream
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Flush the compressor every N records so clients see data while the scan runs
+FLUSH_EVERY = 500
+
+# Identifies the in-memory history of this process; cursors from other processes are stale
+EPOCH = secrets.token_hex(8)
+
+
+class StaleCursorError(ValueError):
+    """Cursor was issued by another process (restart or different worker)"""
+
+
+def format_cursor(position: int, epoch: str = EPOCH) -> str:
+    return f"{epoch}:{position}"
+
+
+def parse_cursor(cursor: Optional[str], epoch: str = EPOCH) -> int:
+    """Turn a cursor into a position in the completion log (empty cursor starts at 0)"""
+    if not cursor:
+        return 0
+    cursor_epoch, _, position = cursor.partition(':')
+    if not position:
+        raise ValueError(f"malformed cursor: {cursor}")
+    if cursor_epoch != epoch:
+        raise StaleCursorError(f"cursor {cursor} belongs to another process (current epoch {epoch})")
+    position = int(position)
+    if position < 0:
+        raise ValueError(f"malformed cursor: {cursor}")
+    return position
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse an ISO timestamp filter as naive local time, matching the stored completed_at
+    Offset-aware values (including a trailing Z) are converted to local time
+    """
+    if not value:
+        return None
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def scan_page(store: dict, completed_log: List[str], position: int, limit: int, max_scan: int,
+              since: Optional[datetime] = None, until: Optional[datetime] = None,
+              source_language: Optional[str] = None,
+              target_language: Optional[str] = None) -> Tuple[List[int], int, bool]:
+    """
+    Find the log positions of up to limit matching records, scanning at most max_scan entries
+    Returns the matching positions, the position to resume from and whether the end of the log
+    was reached; only positions are collected, so memory stays bounded by the page size
+    """
+    matches = []
+    stop = min(len(completed_log), position + max_scan)
+    # Index the log instead of iterating it, so concurrent appends are safe
+    while position < stop and len(matches) < limit:
+        data = store.get(completed_log[position])
+        position += 1
+        if data is None or data.get('status') != 'completed':
+            continue
+        if source_language and data.get('source_language') != source_language:
+            continue
+        if target_language and data.get('target_language') != target_language:
+            continue
+        if since or until:
+            try:
+                completed_at = datetime.fromisoformat(data['completed_at'])
+            except (KeyError, ValueError):
+                continue
+            if since and completed_at < since:
+                continue
+            if until and completed_at >= until:
+                continue
+        matches.append(position - 1)
+    return matches, position, position >= len(completed_log)
+
+
+def iter_records(store: dict, completed_log: List[str], positions: List[int],
+                 epoch: str = EPOCH) -> Iterator[dict]:
+    """
+    Yield the export records at the given log positions
+    completed_log is append-only, so every record carries the cursor to resume from after it
+    """
+    for position in positions:
+        request_id = completed_log[position]
+        data = store[request_id]
+        yield {
+            'cursor': format_cursor(position + 1, epoch),
+            'request_id': request_id,
+            'source_language': data.get('source_language'),
+            'target_language': data.get('target_language'),
+            'original_text': data.get('original_text'),
+            'translation': data.get('translation'),
+            'timestamp': data.get('timestamp'),
+            'completed_at': data.get('completed_at'),
+            'duration_seconds': data.get('duration_seconds')
+        }
+
+
+def gzip_jsonl(records: Iterator[dict]) -> Iterator[bytes]:
+    """Encode records as JSON lines and compress them chunk by chunk"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+    for count, record in enumerate(records, 1):
+        chunk = compressor.compress(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        if count % FLUSH_EVERY == 0:
+            chunk += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def download_page(url: str, admin_token: str, params: dict, timeout: int = 30):
+    """
+    Download one export page into a temporary buffer
+    Returns the buffer (rewound), the number of records, the next cursor and whether the
+    end of the history was reached; a page that does not end in a complete gzip member
+    raises IOError so a partial page never reaches the output file
+    """
+    response = requests.get(url, headers={'X-Admin-Token': admin_token}, params=params,
+                            stream=True, timeout=timeout)
+    if response.status_code == 409:
+        raise StaleCursorError(response.json().get('error', 'stale cursor'))
+    response.raise_for_status()
+    next_cursor = response.headers['X-Export-Next-Cursor']
+    end_of_log = response.headers.get('X-Export-End') == 'true'
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    count = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        buffer.write(chunk)
+        count += decompressor.decompress(chunk).count(b'\n')
+    if not decompressor.eof:
+        buffer.close()
+        raise IOError('export page was cut off before the end of its gzip stream')
+    buffer.seek(0)
+    return buffer, count, next_cursor, end_of_log
+
+
+@click.command()
+@click.option('--url', default=None, help='Base URL of the running app (defaults to PRODUCTION_URL or localhost)')
+@click.option('--output', default=None, help='Output .jsonl.gz file')
+@click.option('--cursor', default=None, help='Resume after this cursor')
+@click.option('--cursor-file', default=None, help='Read the cursor from and store the next cursor in this file')
+@click.option('--since', default=None, help='Only translations completed at or after this ISO timestamp')
+@click.option('--until', default=None, help='Only translations completed before this ISO timestamp')
+@click.option('--source', default=None, help='Source language code')
+@click.option('--target', default=None, help='Target language code')
+@click.option('--page-size', type=int, default=None, help='Records per request (capped by the server)')
+@click.option('--limit', type=int, default=None, help='Maximum number of records in total')
+def main(url, output, cursor, cursor_file, since, until, source, target, page_size, limit):
+    """Download completed translations from a running app as gzip-compressed JSONL"""
+    if not config.admin_token:
+        raise click.ClickException('ADMIN_TOKEN must be set to export translations')
+
+    base_url = url or os.getenv('PRODUCTION_URL') or f"http://localhost:{os.environ.get('PORT', config.flask_port)}"
+    export_url = f"{base_url.rstrip('/')}/admin/export"
+    if cursor is None and cursor_file and os.path.exists(cursor_file):
+        with open(cursor_file) as f:
+            cursor = f.read().strip() or None
+    output = output or f"translations-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+    if os.path.exists(output):
+        raise click.ClickException(f'{output} already exists; choose another --output')
+
+    filters = {'since': since, 'until': until, 'source': source, 'target': target}
+    filters = {k: v for k, v in filters.items() if v is not None}
+
+    click.echo(f"📤 Exporting from {base_url} starting at cursor {cursor or 'beginning'}")
+    total = 0
+    out = None
+    try:
+        while limit is None or total < limit:
+            params = dict(filters, cursor=cursor or '')
+            if page_size is not None:
+                params['limit'] = page_size
+            if limit is not None:
+                params['limit'] = min(params.get('limit', limit), limit - total)
+            try:
+                page, count, cursor, end_of_log = download_page(export_url, config.admin_token, params)
+            except StaleCursorError as e:
+                raise click.ClickException(f'{e}. The app was restarted and its in-memory history is gone; '
+                                           f'remove the cursor and use --since to continue by time instead')
+            except (requests.exceptions.RequestException, IOError) as e:
+                raise click.ClickException(f'Export failed: {e}. Completed pages are kept; run again to resume')
+
+            # Only complete pages are appended; concatenated gzip members are still a valid gzip file
+            with page:
+                if count:
+                    if out is None:
+                        out = open(output, 'xb')
+                    shutil.copyfileobj(page, out)
+                    out.flush()
+            total += count
+            if cursor_file:
+                with open(cursor_file, 'w') as f:
+                    f.write(cursor)
+            click.echo(f"  {count} records, next cursor: {cursor}")
+
+            if end_of_log:
+                break
+    finally:
+        if out is not None:
+            out.close()
+
+    if out is None:
+        click.echo("✅ No new translations, nothing written")
+    else:
+        click.echo(f"✅ Exported {total} translations to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Request instrumentation for EU eTranslation App
+Per-route and per-phase timers plus an on-demand sampling profiler
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+from flask import g, has_request_context, request
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block of work and attribute it to the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, (time.perf_counter() - start) * 1000)
+
+
+def record_phase(name: str, duration_ms: float):
+    """Add a duration to a named phase of the current request (no-op outside requests)"""
+    if not has_request_context():
+        return
+    timings = g.setdefault('phase_timings', {})
+    timings[name] = timings.get(name, 0.0) + duration_ms
+
+
+def record_upstream_phases(response):
+    """
+    Split an eTranslation round trip into auth and response phases
+    With digest auth the first exchange is the 401 challenge, kept in response.history
+    """
+    auth_ms = sum(r.elapsed.total_seconds() * 1000 for r in response.history)
+    if auth_ms:
+        record_phase('upstream-auth', auth_ms)
+    record_phase('upstream-response', response.elapsed.total_seconds() * 1000)
+
+
+class RouteStats:
+    """Thread-safe aggregate of request and phase durations per route"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route: str, total_ms: float, phases: Dict[str, float]):
+        with self._lock:
+            entry = self._routes.setdefault(route, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'phases': {}})
+            entry['count'] += 1
+            entry['total_ms'] += total_ms
+            entry['max_ms'] = max(entry['max_ms'], total_ms)
+            for name, duration_ms in phases.items():
+                stats = entry['phases'].setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                stats['count'] += 1
+                stats['total_ms'] += duration_ms
+                stats['max_ms'] = max(stats['max_ms'], duration_ms)
+
+    def snapshot(self) -> dict:
+        """Return a copy of the aggregates with averages filled in"""
+        with self._lock:
+            result = {}
+            for route, entry in self._routes.items():
+                result[route] = {
+                    'count': entry['count'],
+                    'avg_ms': round(entry['total_ms'] / entry['count'], 2),
+                    'max_ms': round(entry['max_ms'], 2),
+                    'phases': {name: {
+                        'count': stats['count'],
+                        'avg_ms': round(stats['total_ms'] / stats['count'], 2),
+                        'max_ms': round(stats['max_ms'], 2)
+                    } for name, stats in entry['phases'].items()}
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads for a limited time
+    Output is written in the folded format understood by flamegraph.pl and speedscope
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.started_at = None
+        self.last_output = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval_ms: float, output_dir: str) -> Optional[str]:
+        """Start a profiling run in the background; returns the output path or None if already running"""
+        with self._lock:
+            if self.running:
+                return None
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded")
+            self.started_at = datetime.now().isoformat()
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, interval_ms / 1000, path), daemon=True
+            )
+            self._thread.start()
+            return path
+
+    def _run(self, seconds: float, interval: float, path: str):
+        own_id = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stacks[_fold_stack(frame)] += 1
+            time.sleep(interval)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.last_output = path
+        print(f"🔥 Profile written to {path} ({sum(stacks.values())} samples)")
+
+
+def _fold_stack(frame) -> str:
+    """Render a frame chain as root-first, semicolon separated frames"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+route_stats = RouteStats()
+profiler = SamplingProfiler()
+
+
+def init_app(app):
+    """Register the timing hooks on a Flask app"""
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        g.phase_timings = {}
+
+    @app.after_request
+    def _record_timings(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        phases = g.get('phase_timings', {})
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+
+        # Server-Timing is shown in the browser devtools network panel
+        entries = [f"{name};dur={duration_ms:.1f}" for name, duration_ms in phases.items()]
+
+        if response.is_streamed:
+            # The body is produced after this hook returns, so the total is only known on close
+            def _record_streamed():
+                route_stats.record(route, (time.perf_counter() - started) * 1000, phases)
+            response.call_on_close(_record_streamed)
+        else:
+            total_ms = (time.perf_counter() - started) * 1000
+            route_stats.record(route, total_ms, phases)
+            entries.append(f"total;dur={total_ms:.1f}")
+
+        if entries:
+            response.headers['Server-Timing'] = ', '.join(entries)
+        return response